@@ -0,0 +1,222 @@
+# Reading and writing images with optional compact (quantized) storage.
+#
+# Copyright (C) 2018 Yves Pauchard
+# License: BSD 3-clause (see LICENSE)
+
+# Quantized images are stored as 16 bit integers together with a linear
+# scale/offset in the image metadata, so that
+#
+#     value = stored * scale + offset
+#
+# The scale is chosen per image from its intensity range, so the maximum
+# absolute error after decoding is scale / 2, i.e. (max - min) / 65535 / 2.
+# For a normalized echo with range 0..200 this is about 0.0015, well below
+# the noise level the images were normalized to (1.0). A few bright outliers
+# widen the range and so increase the error for all voxels, e.g. a single
+# failed fit with T2 = 100000 in a T2 map gives an error of up to 0.76 for
+# every voxel. A value range clips the image and fixes the scale instead,
+# for 0..500 the error is at most 0.0038. The scale and error actually used
+# are logged for every quantized image.
+#
+# Images containing NaN, or inf without a value range, can not be quantized
+# and are written as float32 instead.
+#
+# The metadata is only preserved by formats that store a free-form header
+# (METADATA_EXTENSIONS), quantized storage is refused for other formats.
+# Tools that ignore the metadata will see the raw integer values.
+#
+# float16 is not offered, SimpleITK/ITK have no half-precision pixel type.
+
+import SimpleITK as sitk
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+SCALE_KEY = 'QuantizationScale'
+OFFSET_KEY = 'QuantizationOffset'
+
+# storage name: (pixel type, smallest stored value, number of levels)
+STORAGE_TYPES = {
+    'float32': (sitk.sitkFloat32, None, None),
+    'int16': (sitk.sitkInt16, -32768, 65536),
+    'uint16': (sitk.sitkUInt16, 0, 65536),
+}
+
+# image formats that keep the scale/offset metadata
+METADATA_EXTENSIONS = ['.mha', '.mhd', '.nrrd', '.nhdr']
+
+
+def is_quantized_storage(storage):
+    """Checks if storage needs scale/offset metadata.
+
+    :param storage: one of STORAGE_TYPES
+    :return: True if storage is quantized
+    """
+    return STORAGE_TYPES[storage][2] is not None
+
+
+def is_storage_ok(storage, file_name=None):
+    """Checks if storage is one of the supported STORAGE_TYPES.
+
+    :param storage: storage name, e.g. 'int16'
+    :param file_name: (optional) image file name, checks that its format keeps the scale/offset
+    :return: True if supported
+    """
+    if storage not in STORAGE_TYPES:
+        print('Storage {} not supported, use one of {}.'.format(storage, ', '.join(sorted(STORAGE_TYPES))))
+        return False
+    if file_name is not None and is_quantized_storage(storage):
+        extension = os.path.splitext(file_name)[1].lower()
+        if extension not in METADATA_EXTENSIONS:
+            print('Storage {} needs one of {} to keep scale/offset, {} can not be used.'.format(
+                storage, ', '.join(METADATA_EXTENSIONS), file_name))
+            return False
+    return True
+
+
+def is_quantized(img):
+    """Checks if image carries quantization scale/offset metadata.
+
+    :param img: SimpleITK image
+    :return: True if image is quantized
+    """
+    return img.HasMetaDataKey(SCALE_KEY) and img.HasMetaDataKey(OFFSET_KEY)
+
+
+def is_quantized_file(file_name):
+    """Checks if an image file carries quantization scale/offset metadata.
+
+    Only the image header is read, not the pixel data.
+
+    :param file_name: path to image
+    :return: True if image is quantized
+    """
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(file_name)
+    reader.ReadImageInformation()
+    return reader.HasMetaDataKey(SCALE_KEY) and reader.HasMetaDataKey(OFFSET_KEY)
+
+
+def parse_value_range(text):
+    """Parses a value range like '0, 500'.
+
+    :param text: two comma separated numbers, low and high
+    :return: tuple (low, high), or None if text is not a valid range
+    """
+    try:
+        low, high = map(float, text.split(','))
+    except ValueError:
+        print('Range {} must be two comma separated numbers, e.g. 0, 500.'.format(text))
+        return None
+    if not low < high:
+        print('Range {} must have low < high.'.format(text))
+        return None
+    return low, high
+
+
+def quantize(img, storage, value_range=None):
+    """Converts a float image to the compact storage type.
+
+    Without value_range the scale is taken from the image minimum and
+    maximum. With value_range, values outside are clipped and the scale is
+    fixed, (high - low) / 65535, which keeps the step size of e.g. T2 maps
+    independent of outliers from failed fits.
+
+    Images with NaN values, or inf values without value_range, are
+    returned as float32.
+
+    :param img: SimpleITK image
+    :param storage: one of STORAGE_TYPES
+    :param value_range: (optional) tuple (low, high) to clip to
+    :return: image in storage pixel type, with scale/offset metadata if quantized
+    """
+    pixel_type, stored_min, levels = STORAGE_TYPES[storage]
+    if levels is None:
+        return sitk.Cast(img, pixel_type)
+
+    values = sitk.Cast(img, sitk.sitkFloat64)
+
+    # NaN != NaN, inf is clipped if a range is given
+    non_finite = values != values
+    if value_range is None:
+        non_finite = sitk.Or(non_finite, sitk.Abs(values) == float('inf'))
+    statistics = sitk.StatisticsImageFilter()
+    statistics.Execute(non_finite)
+    if statistics.GetSum() > 0:
+        logger.warning("Image has {} non-finite values, storing as float32 instead of {}".format(
+            int(statistics.GetSum()), storage))
+        return sitk.Cast(img, sitk.sitkFloat32)
+
+    if value_range is None:
+        min_max = sitk.MinimumMaximumImageFilter()
+        min_max.Execute(values)
+        value_min = min_max.GetMinimum()
+        value_max = min_max.GetMaximum()
+    else:
+        value_min, value_max = value_range
+        statistics.Execute(sitk.Or(values < value_min, values > value_max))
+        logger.info("Clipping {} values to range {}".format(int(statistics.GetSum()), value_range))
+        values = sitk.Clamp(values, sitk.sitkFloat64, value_min, value_max)
+
+    if value_max > value_min:
+        scale = (value_max - value_min) / (levels - 1)
+    else:
+        scale = 1.0  # constant image
+
+    # all values are >= 0 here, so adding 0.5 and truncating rounds to nearest
+    stored = sitk.Cast((values - value_min) / scale + 0.5, sitk.sitkInt32)
+    stored = sitk.Clamp(stored, sitk.sitkInt32, 0, levels - 1)
+    stored = sitk.Cast(stored + stored_min, pixel_type)
+
+    # fold the shift of the stored range into the offset
+    offset = value_min - stored_min * scale
+
+    logger.info("Quantizing to {} with scale {} and offset {}, max error {}".format(
+        storage, scale, offset, scale / 2))
+
+    stored.CopyInformation(img)
+    for key in img.GetMetaDataKeys():
+        stored.SetMetaData(key, img.GetMetaData(key))
+    stored.SetMetaData(SCALE_KEY, repr(scale))
+    stored.SetMetaData(OFFSET_KEY, repr(offset))
+    return stored
+
+
+def dequantize(img):
+    """Converts an image to float, applying scale/offset metadata if present.
+
+    :param img: SimpleITK image
+    :return: image as sitkFloat32
+    """
+    if not is_quantized(img):
+        return sitk.Cast(img, sitk.sitkFloat32)
+
+    scale = float(img.GetMetaData(SCALE_KEY))
+    offset = float(img.GetMetaData(OFFSET_KEY))
+    decoded = sitk.Cast(sitk.Cast(img, sitk.sitkFloat64) * scale + offset, sitk.sitkFloat32)
+    decoded.CopyInformation(img)
+    return decoded
+
+
+def read_image(file_name):
+    """Reads an image and returns it as float, decoding quantized storage.
+
+    :param file_name: path to image
+    :return: image as sitkFloat32
+    """
+    return dequantize(sitk.ReadImage(file_name))
+
+
+def write_image(img, file_name, storage='float32', value_range=None):
+    """Writes an image in the requested storage type.
+
+    :param img: SimpleITK image
+    :param file_name: path to image
+    :param storage: (optional, default is float32) one of STORAGE_TYPES
+    :param value_range: (optional) tuple (low, high) to clip quantized images to, see quantize
+    :raises ValueError: if storage is not supported or the file format can not keep scale/offset
+    """
+    if not is_storage_ok(storage, file_name):
+        raise ValueError('Can not write {} as {}'.format(file_name, storage))
+    sitk.WriteImage(quantize(img, storage, value_range), file_name)
@@ -6,11 +6,13 @@
 
 import SimpleITK as sitk
 import os
+import sys
 import logging
 import configparser
 import argparse
-import csv
 
+import image_io
+import pipeline_config
 
 
 # Create and configure logger
@@ -32,43 +34,25 @@ def is_ini_ok(parser):
         # optional, default is _norm
         # output_filename_ending = _norm
 
+        # optional, default is float32, see image_io.STORAGE_TYPES
+        # output_storage = uint16
+
+        # optional, clip range for int16/uint16, default is the image minimum, maximum
+        # output_range = 0, 500
+
 
     """
     expected_sections = [ 'normalize' ]
     expected_options = [ 'input_dir', 'image_list_csv', 'output_dir' ]
-    is_ok = True
-    for section in expected_sections:
-        if not parser.has_section(section) :
-            print('Config section {} missing, please add.'.format(section))
+    is_ok = pipeline_config.is_ini_ok(parser, expected_sections, expected_options)
+    if parser.has_option('normalize', 'output_storage'):
+        if not image_io.is_storage_ok(parser.get('normalize', 'output_storage')):
+            is_ok = False
+    if parser.has_option('normalize', 'output_range'):
+        if image_io.parse_value_range(parser.get('normalize', 'output_range')) is None:
             is_ok = False
-        else:
-            for candidate in expected_options:
-                if not parser.has_option(section, candidate):
-                    print( 'Option {}.{} missing, please add.'.format(section, candidate ))
-                    is_ok = False
     return is_ok
 
-def get_image_value_list(csv_file_name):
-    """
-        Expects a csv file with header/structure:
-        filename, TE, mean_background
-
-        skips the first (header) line
-
-        returns a list of tuples with (filename, mean_background)
-    """
-    image_value_list = []
-
-    with open(csv_file_name) as csvfile:
-        readCSV = csv.reader(csvfile, delimiter=',')
-
-        # skip the header (first) line
-        next(readCSV)
-
-        for row in readCSV:
-            image_value_list.append((row[0], row[2]))
-    return image_value_list
-
 # Argument parser
 a_parser = argparse.ArgumentParser(
     description='Normalizes a list of images to a reference value using SimpleITK.',
@@ -85,10 +69,12 @@ config.read(args.path_to_ini_file)
 
 # Check that all parameters needed are in configuration
 if not is_ini_ok(config):
-    exit(0)
+    sys.exit(1)
 
 input_dir = config.get('normalize', 'input_dir')
-image_and_values = get_image_value_list(config.get('normalize', 'image_list_csv'))
+image_list = pipeline_config.read_image_list(config.get('normalize', 'image_list_csv'))
+if image_list is None:
+    sys.exit(1)
 output_dir = config.get('normalize', 'output_dir')
 
 # optional config parameter
@@ -100,43 +86,48 @@ if config.has_option('normalize','output_filename_ending'):
     output_filename_ending = config.get('normalize','output_filename_ending')
 else:
     output_filename_ending = '_norm'
+if config.has_option('normalize', 'output_storage'):
+    output_storage = config.get('normalize', 'output_storage')
+else:
+    output_storage = 'float32'
+if config.has_option('normalize', 'output_range'):
+    output_range = image_io.parse_value_range(config.get('normalize', 'output_range'))
+else:
+    output_range = None
 
 logger.info("Parameters from {}".format(args.path_to_ini_file))
 logger.info(input_dir)
-logger.info(image_and_values)
+logger.info(image_list)
 logger.info(filename_ending)
 logger.info(output_dir)
 logger.info(output_filename_ending)
+logger.info(output_storage)
+logger.info(output_range)
+
+# Check all images before starting the normalization
+input_paths = pipeline_config.stage_paths(image_list, input_dir, filename_ending)
+output_paths = pipeline_config.stage_paths(image_list, output_dir, filename_ending + output_filename_ending)
+if not pipeline_config.are_images_ok(input_paths):
+    sys.exit(1)
+# Output format must keep scale/offset if quantized
+if not all([image_io.is_storage_ok(output_storage, output_path) for output_path in output_paths]):
+    sys.exit(1)
 
 #check if output_dir exists, create if not.
 if not os.path.exists(output_dir):
     logger.info("Creating output directory {}".format(output_dir))
     os.makedirs(output_dir)
 
-for image_value in image_and_values:
-
-    #unpack tuple
-    image_name, value = image_value
-
-    # Add filename ending
-    split_filename = os.path.splitext(image_name)
-    image_name =  split_filename[0] + filename_ending + split_filename[1]
+for entry, input_path, output_path in zip(image_list, input_paths, output_paths):
 
     # Read moving image
-    logger.info("Reading image {}".format(image_name))
-    #moving = sitk.ReadImage(os.path.join(input_path, moving_image_name))
-    img = sitk.ReadImage(os.path.join(input_dir, image_name))
-    img = sitk.Cast(img, sitk.sitkFloat32)  # we will do division on floats
+    logger.info("Reading image {}".format(input_path))
+    img = image_io.read_image(input_path)  # we will do division on floats
 
     # normalize
-    logger.info("Normalizing image with {}".format(value))
-    img /= value
-
-    # Create normalized image name
-    filename = os.path.basename(image_name)
-    split_filename = os.path.splitext(filename)  # gets filename and extension
-    ouput_file_name = split_filename[0] + output_filename_ending + split_filename[1]
+    logger.info("Normalizing image with {}".format(entry.background))
+    img /= entry.background
 
-    # Save registered image
-    logger.info("Writing normalized image {}".format(ouput_file_name))
-    sitk.WriteImage(img, os.path.join(output_dir, ouput_file_name))
+    # Save normalized image
+    logger.info("Writing normalized image {} as {}".format(output_path, output_storage))
+    image_io.write_image(img, output_path, output_storage, output_range)
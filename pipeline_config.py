@@ -0,0 +1,160 @@
+# Shared configuration and image list handling for the pipeline scripts.
+#
+# Copyright (C) 2018 Yves Pauchard
+# License: BSD 3-clause (see LICENSE)
+
+# All inputs are checked before any registration, normalization or mapping
+# starts, so that a missing file or a mismatched image fails right away
+# instead of in the middle of a run. Only image headers are read.
+
+import SimpleITK as sitk
+import os
+import csv
+from collections import namedtuple
+
+# One row of image_list.csv
+ImageEntry = namedtuple('ImageEntry', ['filename', 'te', 'background'])
+
+# relative tolerance when comparing spacing of images
+SPACING_TOLERANCE = 1e-4
+
+
+def is_ini_ok(parser, expected_sections, expected_options):
+    """Checks if ini file has the expected sections, each with the expected options.
+
+    :param parser: configparser.ConfigParser with ini file read
+    :param expected_sections: list of section names
+    :param expected_options: list of option names expected in every section
+    :return: True if all sections and options are present
+    """
+    is_ok = True
+    for section in expected_sections:
+        if not parser.has_section(section) :
+            print('Config section {} missing, please add.'.format(section))
+            is_ok = False
+        else:
+            for candidate in expected_options:
+                if not parser.has_option(section, candidate):
+                    print( 'Option {}.{} missing, please add.'.format(section, candidate ))
+                    is_ok = False
+    return is_ok
+
+
+def read_image_list(csv_file_name):
+    """
+        Expects a csv file with header/structure:
+        filename, TE, mean_background
+
+        skips the first (header) line
+
+        returns a list of ImageEntry(filename, te, background) with te and
+        background as float, or None if the file is missing or malformed.
+    """
+    if not os.path.isfile(csv_file_name):
+        print('Image list {} not found.'.format(csv_file_name))
+        return None
+
+    image_list = []
+    is_ok = True
+
+    with open(csv_file_name) as csvfile:
+        readCSV = csv.reader(csvfile, delimiter=',')
+
+        # skip the header (first) line
+        next(readCSV, None)
+
+        for line_number, row in enumerate(readCSV, start=2):
+            if not row or not ''.join(row).strip():
+                continue  # skip empty lines
+            if len(row) < 3:
+                print('{} line {}: expected filename, TE, mean_background.'.format(csv_file_name, line_number))
+                is_ok = False
+                continue
+            try:
+                entry = ImageEntry(row[0].strip(), float(row[1]), float(row[2]))
+            except ValueError:
+                print('{} line {}: TE and mean_background must be numbers.'.format(csv_file_name, line_number))
+                is_ok = False
+                continue
+            if not entry.te > 0 or not entry.background > 0:
+                print('{} line {}: TE and mean_background must be larger than 0.'.format(csv_file_name, line_number))
+                is_ok = False
+                continue
+            image_list.append(entry)
+
+    if is_ok and not image_list:
+        print('Image list {} has no images.'.format(csv_file_name))
+        is_ok = False
+
+    if not is_ok:
+        return None
+    return image_list
+
+
+def stage_file_name(filename, filename_ending):
+    """Adds the ending of a pipeline stage to a file name.
+
+    Example: stage_file_name('D1_TE10.8.mha', '_reg') returns 'D1_TE10.8_reg.mha'
+
+    :param filename: image file name
+    :param filename_ending: ending to add before the extension
+    :return: file name with ending
+    """
+    split_filename = os.path.splitext(os.path.basename(filename))  # gets filename and extension
+    return split_filename[0] + filename_ending + split_filename[1]
+
+
+def stage_paths(image_list, directory, filename_ending=''):
+    """Gets the paths of all images in image_list for a pipeline stage.
+
+    Example: stage_paths(image_list, 'register/', '_reg') returns
+    ['register/D1_TE10.8_reg.mha', ...]
+
+    :param image_list: list of ImageEntry
+    :param directory: directory of the stage
+    :param filename_ending: (optional, default is no ending) ending of the stage
+    :return: list of paths, in the order of image_list
+    """
+    return [os.path.join(directory, stage_file_name(entry.filename, filename_ending)) for entry in image_list]
+
+
+def are_images_ok(image_paths):
+    """Checks that all images exist and have the same size and spacing.
+
+    Only the image headers are read, not the pixel data.
+
+    :param image_paths: list of paths to images
+    :return: True if all images exist and match the first one
+    """
+    is_ok = True
+    reader = sitk.ImageFileReader()
+    reference = None
+
+    for image_path in image_paths:
+        if not os.path.isfile(image_path):
+            print('Image {} not found.'.format(image_path))
+            is_ok = False
+            continue
+
+        reader.SetFileName(image_path)
+        try:
+            reader.ReadImageInformation()
+        except RuntimeError:
+            print('Image {} can not be read.'.format(image_path))
+            is_ok = False
+            continue
+
+        size = reader.GetSize()
+        spacing = reader.GetSpacing()
+        if reference is None:
+            reference = (image_path, size, spacing)
+            continue
+
+        reference_path, reference_size, reference_spacing = reference
+        if size != reference_size:
+            print('Image {} has size {}, but {} has size {}.'.format(image_path, size, reference_path, reference_size))
+            is_ok = False
+        if any(abs(s - r) > SPACING_TOLERANCE * abs(r) for s, r in zip(spacing, reference_spacing)):
+            print('Image {} has spacing {}, but {} has spacing {}.'.format(image_path, spacing, reference_path, reference_spacing))
+            is_ok = False
+    return is_ok
@@ -5,10 +5,12 @@
 
 import SimpleITK as sitk
 import os
+import sys
 import logging
 import configparser
 import argparse
-import csv
+
+import pipeline_config
 
 #TODO: clean up how we know what are expected ini sections and options.
 # Now it is defined in multiple locations.
@@ -36,36 +38,7 @@ def is_ini_ok(parser):
     """
     expected_sections = [ 'register' ]
     expected_options = [ 'reference_image', 'reference_mask', 'input_dir', 'images_to_register', 'output_dir' ]
-    is_ok = True
-    for section in expected_sections:
-        if not parser.has_section(section) :
-            print('Config section {} missing, please add.'.format(section))
-            is_ok = False
-        else:
-            for candidate in expected_options:
-                if not parser.has_option(section, candidate):
-                    print( 'Option {}.{} missing, please add.'.format(section, candidate ))
-                    is_ok = False
-    return is_ok
-
-def get_image_list(csv_file_name):
-    """
-        Expects a csv file with header/structure:
-        filename, TE, mean_background
-
-        skips the first (header) line
-    """
-    file_list = []
-
-    with open(csv_file_name) as csvfile:
-        readCSV = csv.reader(csvfile, delimiter=',')
-
-        # skip the header (first) line
-        next(readCSV)
-
-        for row in readCSV:
-            file_list.append(row[0])
-    return file_list
+    return pipeline_config.is_ini_ok(parser, expected_sections, expected_options)
 
 def print_values(registration_method):
     """Callback invoked when the IterationEvent happens, print values.
@@ -164,13 +137,15 @@ config.read(args.path_to_ini_file)
 
 # Check that all parameters needed are in configuration
 if not is_ini_ok(config):
-    exit(0)
+    sys.exit(1)
 
 # Get parameters from config reader
 fixed_image_name = config.get('register','reference_image')
 fixed_mask_name = config.get('register','reference_mask')
 
-moving_image_names = get_image_list(config.get('register', 'images_to_register'))
+image_list = pipeline_config.read_image_list(config.get('register', 'images_to_register'))
+if image_list is None:
+    sys.exit(1)
 input_dir = config.get('register', 'input_dir')
 output_dir = config.get('register', 'output_dir')
 
@@ -184,10 +159,16 @@ logger.info("Parameters from {}".format(args.path_to_ini_file))
 logger.info(fixed_image_name)
 logger.info(fixed_mask_name)
 logger.info(input_dir)
-logger.info(moving_image_names)
+logger.info(image_list)
 logger.info(output_dir)
 logger.info(output_filename_ending)
 
+# Check all images before starting the registrations
+moving_image_paths = pipeline_config.stage_paths(image_list, input_dir)
+registered_image_paths = pipeline_config.stage_paths(image_list, output_dir, output_filename_ending)
+if not pipeline_config.are_images_ok([fixed_image_name, fixed_mask_name] + moving_image_paths):
+    sys.exit(1)
+
 # Read fixed image
 logger.info("Reading fixed image {}".format(fixed_image_name))
 fixed = sitk.ReadImage(fixed_image_name)
@@ -202,20 +183,15 @@ if not os.path.exists(output_dir):
     os.makedirs(output_dir)
 
 # For all moving images do registration
-for moving_image_name in moving_image_names:
+for moving_image_path, registered_image_path in zip(moving_image_paths, registered_image_paths):
     # Read moving image
-    logger.info("Reading moving image {}".format(moving_image_name))
-    moving = sitk.ReadImage(os.path.join(input_dir, moving_image_name))
+    logger.info("Reading moving image {}".format(moving_image_path))
+    moving = sitk.ReadImage(moving_image_path)
     moving = sitk.Cast(moving, sitk.sitkFloat32)  # image registration needs float
     # register images
     logger.info("Register images")
     moving_resampled, final_transform = register_two_images(fixed, moving, fixed_mask_image=fixed_mask)
 
-    # Create registered image name
-    filename = os.path.basename(moving_image_name)
-    split_filename = os.path.splitext(filename)  # gets filename and extension
-    registered_file_name = split_filename[0] + output_filename_ending + split_filename[1]
-
     # Save registered image
-    logger.info("Writing registered image {}".format(registered_file_name))
-    sitk.WriteImage(moving_resampled, os.path.join(output_dir, registered_file_name))
+    logger.info("Writing registered image {}".format(registered_image_path))
+    sitk.WriteImage(moving_resampled, registered_image_path)
@@ -4,11 +4,16 @@
 # License: BSD 3-clause (see LICENSE)
 
 import os
+import sys
 import subprocess
 import logging
 import configparser
 import argparse
-import csv
+import glob
+import tempfile
+
+import image_io
+import pipeline_config
 
 # path to t2mapping executable expected in ./bin/t2mapping
 current_script_path = os.path.realpath(__file__)
@@ -45,55 +50,98 @@ def is_ini_ok(parser):
         # default 0.0
         # threshold = 30.5
 
+        # default float32, see image_io.STORAGE_TYPES
+        # int16/uint16 need the executable to write .mha/.mhd/.nrrd
+        # output_storage = uint16
+
+        # clip range for int16/uint16, default is the image minimum, maximum
+        # output_range = 0, 500
+
 
     """
     expected_sections = [ 't2map' ]
     expected_options = ['experiments_to_run']
     expected_experiment_options = [ 'input_dir', 'image_list_csv', 'images_to_use', 'output_dir' , 'output_basename']
-    is_ok = True
-    for section in expected_sections:
-        if not parser.has_section(section) :
-            print('Config section {} missing, please add.'.format(section))
-            is_ok = False
-        else:
-            for candidate in expected_options:
-                if not parser.has_option(section, candidate):
-                    print( 'Option {}.{} missing, please add.'.format(section, candidate ))
-                    is_ok = False
+    is_ok = pipeline_config.is_ini_ok(parser, expected_sections, expected_options)
     # if main section is OK, check experiment sections
     if is_ok:
         experiments = parser.get('t2map','experiments_to_run').replace(" ","").split(',')
         for experiment in experiments:
-            if not parser.has_section(experiment) :
-                print('Config section {} missing, please add.'.format(experiment))
+            if not pipeline_config.is_ini_ok(parser, [experiment], expected_experiment_options):
                 is_ok = False
             else:
-                for candidate in expected_experiment_options:
-                    if not parser.has_option(experiment, candidate):
-                        print( 'Option {}.{} missing, please add.'.format(experiment, candidate ))
+                if parser.has_option(experiment, 'output_storage'):
+                    if not image_io.is_storage_ok(parser.get(experiment, 'output_storage')):
+                        is_ok = False
+                if parser.has_option(experiment, 'output_range'):
+                    if image_io.parse_value_range(parser.get(experiment, 'output_range')) is None:
                         is_ok = False
     return is_ok
 
-def get_image_value_list(csv_file_name):
+def get_input_filename_ending(parser, experiment):
+    """Gets the optional input_filename_ending of an experiment, default is _reg_norm."""
+    if parser.has_option(experiment,'input_filename_ending'):
+        return parser.get(experiment,'input_filename_ending')
+    return '_reg_norm'
+
+def get_experiment_images(parser, experiment):
+    """Gets the images and TEs used by an experiment and checks the images.
+
+    :param parser: configparser.ConfigParser with ini file read
+    :param experiment: name of experiment section
+    :return: list of tuples with (image path, TE), or None if not ok
     """
-        Expects a csv file with header/structure:
-        filename, TE, mean_background
+    image_list = pipeline_config.read_image_list(parser.get(experiment, 'image_list_csv'))
+    if image_list is None:
+        return None
+
+    # this is a comma separated string, so we have to split and convert to int
+    try:
+        images_to_use = list(map(int, parser.get(experiment, 'images_to_use').split(',')))
+    except ValueError:
+        print('Option {}.images_to_use must be a comma separated list of integers.'.format(experiment))
+        return None
+    for idx in images_to_use:
+        if not 0 <= idx < len(image_list):
+            print('Option {}.images_to_use: index {} not in image list with {} images.'.format(experiment, idx, len(image_list)))
+            return None
+
+    image_paths = pipeline_config.stage_paths(image_list, parser.get(experiment, 'input_dir'),
+                                              get_input_filename_ending(parser, experiment))
+    images_and_te = [(image_paths[idx], image_list[idx].te) for idx in images_to_use]
+
+    if not pipeline_config.are_images_ok([image_path for image_path, te in images_and_te]):
+        return None
+    return images_and_te
+
+def get_float_image_path(image_path, temp_dir):
+    """Returns a path to image_path that the t2mapping executable can read.
 
-        skips the first (header) line
+    The executable does not know about the scale/offset metadata, so
+    quantized images are decoded to a float copy in temp_dir.
 
-        returns a list of tuples with (filename, TE)
+    :param image_path: path to image
+    :param temp_dir: directory for decoded copies
+    :return: image_path, or path to decoded copy
     """
-    image_value_list = []
+    if not image_io.is_quantized_file(image_path):
+        return image_path
 
-    with open(csv_file_name) as csvfile:
-        readCSV = csv.reader(csvfile, delimiter=',')
+    float_image_path = os.path.join(temp_dir, os.path.basename(image_path))
+    logger.info("Decoding quantized image {} to {}".format(image_path, float_image_path))
+    image_io.write_image(image_io.read_image(image_path), float_image_path)
+    return float_image_path
 
-        # skip the header (first) line
-        next(readCSV)
+def get_output_files(full_output_basename):
+    """Finds the files written by the t2mapping executable for full_output_basename.
 
-        for row in readCSV:
-            image_value_list.append((row[0], row[1].strip()))
-    return image_value_list
+    The executable adds an ending to the basename for each map (e.g. _T2, _S0).
+
+    :param full_output_basename: output path and basename as passed to the executable
+    :return: dictionary with file name: modification time in ns
+    """
+    return {file_name: os.stat(file_name).st_mtime_ns
+            for file_name in glob.glob(glob.escape(full_output_basename) + '_*')}
 
 # Argument parser
 a_parser = argparse.ArgumentParser(
@@ -111,27 +159,30 @@ config.read(args.path_to_ini_file)
 
 # Check that all parameters needed are in configuration
 if not is_ini_ok(config):
-    exit(0)
+    sys.exit(1)
 
 # Get all experiments remove whitespces and split into list
 experiments = config.get('t2map','experiments_to_run').replace(" ","").split(',')
 
 logger.info("Experiemnts {} defined in {}".format(experiments, args.path_to_ini_file))
 
+# Check images of all experiments before starting any mapping
+experiment_images = {}
+for experiment in experiments:
+    experiment_images[experiment] = get_experiment_images(config, experiment)
+if None in experiment_images.values():
+    sys.exit(1)
+
+# outputs that could not be converted to output_storage
+not_converted = []
+
 for experiment in experiments:
 
     # get parameters
-    input_dir = config.get(experiment, 'input_dir')
-    image_and_values = get_image_value_list(config.get(experiment, 'image_list_csv'))
+    images_and_te = experiment_images[experiment]
     output_dir = config.get(experiment, 'output_dir')
-    # this is a comma separated string, so we have to split and convert to int
-    images_to_use = list(map(int, config.get(experiment, 'images_to_use').split(',')))
     output_basename = config.get(experiment, 'output_basename')
     # get optional parameters
-    if config.has_option(experiment,'input_filename_ending'):
-        filename_ending = config.get(experiment,'input_filename_ending')
-    else:
-        filename_ending = '_reg_norm'
     if config.has_option(experiment, 'method'):
         method = config.get(experiment, 'method')
     else:
@@ -140,38 +191,67 @@ for experiment in experiments:
         threshold = config.get(experiment, 'threshold')
     else:
         threshold = '0.0'
+    if config.has_option(experiment, 'output_storage'):
+        output_storage = config.get(experiment, 'output_storage')
+    else:
+        output_storage = 'float32'
+    if config.has_option(experiment, 'output_range'):
+        output_range = image_io.parse_value_range(config.get(experiment, 'output_range'))
+    else:
+        output_range = None
 
     logger.info("Parameters for {} found in {}".format(experiment, args.path_to_ini_file))
-    logger.info(input_dir)
-    logger.info(image_and_values)
-    logger.info(filename_ending)
+    logger.info(config.get(experiment, 'input_dir'))
+    logger.info(config.get(experiment, 'images_to_use'))
+    logger.info(get_input_filename_ending(config, experiment))
+    logger.info(images_and_te)
     logger.info(output_dir)
-    logger.info(images_to_use)
     logger.info(output_basename)
     logger.info(method)
     logger.info(threshold)
+    logger.info(output_storage)
+    logger.info(output_range)
 
     # T2mapping needs full path for output
     full_output_basename = os.path.join(output_dir, output_basename)
 
-    # creating subprocess call list
-    call_list = [exec_path,
-                full_output_basename,
-                method,
-                threshold]
-    for idx in images_to_use:
-        image, te = image_and_values[idx]
-        split_filename = os.path.splitext(image)
-        image =  split_filename[0] + filename_ending + split_filename[1]
-        call_list.append(os.path.join(input_dir, image))
-        call_list.append(te)
-
     #check if output_dir exists, create if not.
     if not os.path.exists(output_dir):
         logger.info("Creating output directory {}".format(output_dir))
         os.makedirs(output_dir)
 
-    logger.info("starting process with: {}".format(call_list))
-
-    # call t2mapping executable
-    subprocess.check_call(call_list)
+    # only outputs written by this call are converted
+    existing_outputs = get_output_files(full_output_basename)
+
+    # decoded copies of quantized input images are removed after the call
+    with tempfile.TemporaryDirectory() as temp_dir:
+
+        # creating subprocess call list
+        call_list = [exec_path,
+                    full_output_basename,
+                    method,
+                    threshold]
+        for image_path, te in images_and_te:
+            call_list.append(get_float_image_path(image_path, temp_dir))
+            call_list.append(str(te))
+
+        logger.info("starting process with: {}".format(call_list))
+
+        # call t2mapping executable
+        subprocess.check_call(call_list)
+
+    # the executable always writes float, convert its outputs if requested
+    if output_storage != 'float32':
+        for output_image, mtime in sorted(get_output_files(full_output_basename).items()):
+            if existing_outputs.get(output_image) == mtime:
+                continue
+            if not image_io.is_storage_ok(output_storage, output_image):
+                not_converted.append(output_image)
+                continue
+            logger.info("Writing {} as {}".format(output_image, output_storage))
+            image_io.write_image(image_io.read_image(output_image), output_image, output_storage, output_range)
+
+# the maps are written, but not in the requested storage
+if not_converted:
+    logger.error("Could not convert {}, kept as float32".format(not_converted))
+    sys.exit(1)
@@ -0,0 +1,147 @@
+# Tests for quantized image storage in image_io.
+#
+# Copyright (C) 2018 Yves Pauchard
+# License: BSD 3-clause (see LICENSE)
+
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+sitk = pytest.importorskip('SimpleITK')
+
+import image_io
+
+
+def make_image(array):
+    img = sitk.GetImageFromArray(array.astype(np.float32))
+    img.SetSpacing((0.5, 0.5, 2.0))
+    img.SetOrigin((1.0, 2.0, 3.0))
+    return img
+
+
+def synthetic_echo():
+    # smooth decay plus noise, range roughly 0..200 like a normalized echo
+    rng = np.random.RandomState(0)
+    z, y, x = np.mgrid[0:8, 0:32, 0:32]
+    return make_image(200.0 * np.exp(-(x + y + z) / 40.0) + rng.normal(0.0, 1.0, x.shape))
+
+
+def max_abs_error(img_a, img_b):
+    return np.max(np.abs(sitk.GetArrayFromImage(img_a).astype(np.float64) -
+                         sitk.GetArrayFromImage(img_b).astype(np.float64)))
+
+
+@pytest.mark.parametrize('storage', ['int16', 'uint16'])
+def test_round_trip_error_within_half_step(storage):
+    img = synthetic_echo()
+    stored = image_io.quantize(img, storage)
+    assert stored.GetPixelID() == image_io.STORAGE_TYPES[storage][0]
+
+    scale = float(stored.GetMetaData(image_io.SCALE_KEY))
+    decoded = image_io.dequantize(stored)
+    assert decoded.GetPixelID() == sitk.sitkFloat32
+    assert decoded.GetSpacing() == img.GetSpacing()
+    assert decoded.GetOrigin() == img.GetOrigin()
+    # float32 rounding of the decoded values adds a few ulp
+    assert max_abs_error(img, decoded) <= scale / 2 + 1e-5
+
+
+@pytest.mark.parametrize('storage', ['int16', 'uint16'])
+def test_scale_offset_survive_mha(tmp_path, storage):
+    img = synthetic_echo()
+    file_name = os.path.join(str(tmp_path), 'echo_norm.mha')
+    image_io.write_image(img, file_name, storage)
+
+    assert image_io.is_quantized_file(file_name)
+    stored = image_io.quantize(img, storage)
+    read_back = sitk.ReadImage(file_name)
+    assert float(read_back.GetMetaData(image_io.SCALE_KEY)) == float(stored.GetMetaData(image_io.SCALE_KEY))
+    assert float(read_back.GetMetaData(image_io.OFFSET_KEY)) == float(stored.GetMetaData(image_io.OFFSET_KEY))
+    assert max_abs_error(image_io.read_image(file_name), image_io.dequantize(stored)) == 0.0
+
+
+@pytest.mark.parametrize('storage', ['int16', 'uint16'])
+def test_constant_image(storage):
+    img = make_image(np.full((4, 5, 6), 42.5))
+    stored = image_io.quantize(img, storage)
+    assert float(stored.GetMetaData(image_io.SCALE_KEY)) == 1.0
+    assert max_abs_error(img, image_io.dequantize(stored)) == 0.0
+
+
+def test_int16_offset_shift():
+    img = synthetic_echo()
+    stored = image_io.quantize(img, 'int16')
+    stored_values = sitk.GetArrayFromImage(stored)
+    assert stored_values.min() == -32768
+    assert stored_values.max() == 32767
+
+    scale = float(stored.GetMetaData(image_io.SCALE_KEY))
+    offset = float(stored.GetMetaData(image_io.OFFSET_KEY))
+    value_min = float(sitk.GetArrayFromImage(img).min())
+    assert offset == pytest.approx(value_min + 32768 * scale)
+
+
+def test_non_finite_stored_as_float32():
+    array = np.ones((4, 5, 6))
+    array[0, 0, 0] = np.nan
+    array[1, 1, 1] = np.inf
+    stored = image_io.quantize(make_image(array), 'int16')
+    assert stored.GetPixelID() == sitk.sitkFloat32
+    assert not image_io.is_quantized(stored)
+
+
+def test_quantized_storage_needs_metadata_format(tmp_path):
+    file_name = os.path.join(str(tmp_path), 'echo_norm.nii')
+    with pytest.raises(ValueError):
+        image_io.write_image(synthetic_echo(), file_name, 'uint16')
+    assert not os.path.exists(file_name)
+    image_io.write_image(synthetic_echo(), file_name, 'float32')
+
+
+def synthetic_t2_map():
+    # cartilage-like T2 values of 20..60 ms, plus a few failed fits in the background
+    rng = np.random.RandomState(0)
+    array = rng.uniform(20.0, 60.0, (8, 32, 32))
+    array[0, 0, :3] = [1e5, 5e4, -200.0]
+    return make_image(array), array[1:]
+
+
+def test_t2_outliers_widen_error():
+    img, cartilage = synthetic_t2_map()
+    stored = image_io.quantize(img, 'int16')
+    scale = float(stored.GetMetaData(image_io.SCALE_KEY))
+    # (100000 + 200) / 65535 / 2, as stated in image_io and the Readme
+    assert scale / 2 == pytest.approx(0.76, abs=0.005)
+    decoded = sitk.GetArrayFromImage(image_io.dequantize(stored))[1:]
+    assert np.max(np.abs(decoded - cartilage)) <= scale / 2 + 1e-4
+
+
+def test_value_range_fixes_step_size():
+    img, cartilage = synthetic_t2_map()
+    stored = image_io.quantize(img, 'int16', value_range=(0.0, 500.0))
+    scale = float(stored.GetMetaData(image_io.SCALE_KEY))
+    assert scale == pytest.approx(500.0 / 65535)
+
+    decoded = sitk.GetArrayFromImage(image_io.dequantize(stored))
+    assert np.max(np.abs(decoded[1:] - cartilage)) <= scale / 2 + 1e-5
+    # outliers are clipped to the range
+    assert decoded[0, 0, :3] == pytest.approx([500.0, 500.0, 0.0], abs=scale)
+
+
+def test_value_range_clips_inf():
+    array = np.full((4, 5, 6), 40.0)
+    array[0, 0, 0] = np.inf
+    stored = image_io.quantize(make_image(array), 'uint16', value_range=(0.0, 500.0))
+    assert image_io.is_quantized(stored)
+    assert sitk.GetArrayFromImage(image_io.dequantize(stored))[0, 0, 0] == pytest.approx(500.0)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('0, 500', (0.0, 500.0)),
+    ('500', None),
+    ('0, x', None),
+    ('500, 0', None),
+])
+def test_parse_value_range(text, expected):
+    assert image_io.parse_value_range(text) == expected
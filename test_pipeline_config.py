@@ -0,0 +1,93 @@
+# Tests for the up-front checks in pipeline_config.
+#
+# Copyright (C) 2018 Yves Pauchard
+# License: BSD 3-clause (see LICENSE)
+
+import os
+
+import pytest
+
+sitk = pytest.importorskip('SimpleITK')
+
+import pipeline_config
+
+HEADER = 'filename, TE, mean_background\n'
+
+
+def write_csv(tmp_path, content):
+    csv_file_name = os.path.join(str(tmp_path), 'image_list.csv')
+    with open(csv_file_name, 'w') as csvfile:
+        csvfile.write(content)
+    return csv_file_name
+
+
+def write_image(tmp_path, name, size=(4, 5, 6), spacing=(0.5, 0.5, 2.0)):
+    img = sitk.Image(list(size), sitk.sitkUInt8)
+    img.SetSpacing(spacing)
+    file_name = os.path.join(str(tmp_path), name)
+    sitk.WriteImage(img, file_name)
+    return file_name
+
+
+def test_read_image_list(tmp_path):
+    csv_file_name = write_csv(tmp_path, HEADER + 'a.mha, 10.8, 13.5\n\nb.mha, 35.0, 20.1\n')
+    image_list = pipeline_config.read_image_list(csv_file_name)
+    assert image_list == [pipeline_config.ImageEntry('a.mha', 10.8, 13.5),
+                          pipeline_config.ImageEntry('b.mha', 35.0, 20.1)]
+
+
+@pytest.mark.parametrize('content', [
+    HEADER + 'a.mha, ten, 13.5\n',  # non-numeric TE
+    HEADER + 'a.mha, 10.8\n',  # row too short
+    HEADER + 'a.mha, 0.0, 13.5\n',  # TE <= 0
+    HEADER + 'a.mha, 10.8, -1.0\n',  # background <= 0
+    HEADER + 'a.mha, 10.8, 13.5\nb.mha, 35.0, 0\n',  # one bad row fails the whole list
+    HEADER,  # header only
+])
+def test_read_image_list_rejects(tmp_path, content):
+    assert pipeline_config.read_image_list(write_csv(tmp_path, content)) is None
+
+
+def test_read_image_list_missing_csv(tmp_path):
+    assert pipeline_config.read_image_list(os.path.join(str(tmp_path), 'missing.csv')) is None
+
+
+def test_stage_paths():
+    image_list = [pipeline_config.ImageEntry('a.mha', 10.8, 13.5),
+                  pipeline_config.ImageEntry('b.nrrd', 35.0, 20.1)]
+    assert pipeline_config.stage_paths(image_list, 'norm', '_reg_norm') == [
+        os.path.join('norm', 'a_reg_norm.mha'), os.path.join('norm', 'b_reg_norm.nrrd')]
+    assert pipeline_config.stage_paths(image_list, 'raw') == [
+        os.path.join('raw', 'a.mha'), os.path.join('raw', 'b.nrrd')]
+
+
+def test_are_images_ok(tmp_path):
+    assert pipeline_config.are_images_ok([write_image(tmp_path, 'a.mha'), write_image(tmp_path, 'b.mha')])
+
+
+def test_are_images_ok_missing_image(tmp_path):
+    assert not pipeline_config.are_images_ok([write_image(tmp_path, 'a.mha'),
+                                              os.path.join(str(tmp_path), 'missing.mha')])
+
+
+def test_are_images_ok_unreadable_image(tmp_path):
+    unreadable = os.path.join(str(tmp_path), 'broken.mha')
+    with open(unreadable, 'w') as broken:
+        broken.write('not an image\n')
+    assert not pipeline_config.are_images_ok([write_image(tmp_path, 'a.mha'), unreadable])
+
+
+def test_are_images_ok_size_mismatch(tmp_path):
+    assert not pipeline_config.are_images_ok([write_image(tmp_path, 'a.mha'),
+                                              write_image(tmp_path, 'b.mha', size=(4, 5, 7))])
+
+
+def test_are_images_ok_spacing_mismatch(tmp_path):
+    assert not pipeline_config.are_images_ok([write_image(tmp_path, 'a.mha'),
+                                              write_image(tmp_path, 'b.mha', spacing=(0.5, 0.6, 2.0))])
+
+
+def test_are_images_ok_spacing_within_tolerance(tmp_path):
+    spacing = (0.5 * (1 + pipeline_config.SPACING_TOLERANCE / 2), 0.5, 2.0)
+    assert pipeline_config.are_images_ok([write_image(tmp_path, 'a.mha'),
+                                          write_image(tmp_path, 'b.mha', spacing=spacing)])